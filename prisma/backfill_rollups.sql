@@ -0,0 +1,62 @@
+-- One-time backfill of event_rollup_hourly from pre-existing events.
+--
+-- The dashboard breakdowns (topPages, browsers, operatingSystems,
+-- devices, topReferrers) read exclusively from event_rollup_hourly,
+-- which the ingest drainer maintains going forward. Run this once after
+-- `prisma migrate` creates the table on a deployment with historical
+-- data, otherwise events ingested before the rollup change never appear
+-- in the breakdowns. Safe to re-run: counts are overwritten, not added.
+--
+-- Requires PostgreSQL 13+ for gen_random_uuid().
+
+INSERT INTO event_rollup_hourly (id, hour, hostname, event_type, dimension, value, count)
+SELECT gen_random_uuid()::text, date_trunc('hour', timestamp), COALESCE(hostname, ''), 'pageview',
+       'path', COALESCE(path, '/'), COUNT(*)
+FROM events
+WHERE event_type = 'pageview'
+GROUP BY 2, 3, 6
+ON CONFLICT (hour, hostname, event_type, dimension, value)
+DO UPDATE SET count = EXCLUDED.count;
+
+INSERT INTO event_rollup_hourly (id, hour, hostname, event_type, dimension, value, count)
+SELECT gen_random_uuid()::text, date_trunc('hour', timestamp), COALESCE(hostname, ''), 'pageview',
+       'browser', COALESCE(browser, 'Unknown'), COUNT(*)
+FROM events
+WHERE event_type = 'pageview'
+GROUP BY 2, 3, 6
+ON CONFLICT (hour, hostname, event_type, dimension, value)
+DO UPDATE SET count = EXCLUDED.count;
+
+INSERT INTO event_rollup_hourly (id, hour, hostname, event_type, dimension, value, count)
+SELECT gen_random_uuid()::text, date_trunc('hour', timestamp), COALESCE(hostname, ''), 'pageview',
+       'os', COALESCE(os, 'Unknown'), COUNT(*)
+FROM events
+WHERE event_type = 'pageview'
+GROUP BY 2, 3, 6
+ON CONFLICT (hour, hostname, event_type, dimension, value)
+DO UPDATE SET count = EXCLUDED.count;
+
+INSERT INTO event_rollup_hourly (id, hour, hostname, event_type, dimension, value, count)
+SELECT gen_random_uuid()::text, date_trunc('hour', timestamp), COALESCE(hostname, ''), 'pageview',
+       'device', COALESCE(device_type, 'Unknown'), COUNT(*)
+FROM events
+WHERE event_type = 'pageview'
+GROUP BY 2, 3, 6
+ON CONFLICT (hour, hostname, event_type, dimension, value)
+DO UPDATE SET count = EXCLUDED.count;
+
+-- Referrers roll up by hostname, mirroring _referrer_host in server.py:
+-- strip the scheme and path, fall back to the raw value (e.g. 'direct').
+INSERT INTO event_rollup_hourly (id, hour, hostname, event_type, dimension, value, count)
+SELECT gen_random_uuid()::text, date_trunc('hour', timestamp), COALESCE(hostname, ''), 'pageview',
+       'referrer',
+       CASE
+           WHEN referrer IS NULL OR referrer = '' THEN 'direct'
+           ELSE COALESCE(NULLIF(split_part(split_part(referrer, '://', 2), '/', 1), ''), referrer)
+       END,
+       COUNT(*)
+FROM events
+WHERE event_type = 'pageview'
+GROUP BY 2, 3, 6
+ON CONFLICT (hour, hostname, event_type, dimension, value)
+DO UPDATE SET count = EXCLUDED.count;